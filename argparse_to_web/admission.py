@@ -0,0 +1,144 @@
+"""Admission control for concurrent runs of the CLI's python api."""
+import logging
+from contextlib import contextmanager
+from threading import Condition
+from time import monotonic
+from typing import Dict
+
+from argparse_to_web.config import QUEUE_FULL_ERR_MSG, \
+    QUEUE_TIMEOUT_ERR_MSG
+
+logger = logging.getLogger(__name__)
+
+
+class AdmissionError(Exception):
+    """Run was not admitted; client should retry later."""
+
+    def __init__(self, msg: str, retry_after: int):
+        """Initialize
+
+        Args:
+            msg (str): Message to display.
+            retry_after (int): Seconds the client should wait before retrying.
+        """
+        super().__init__(msg)
+        self.retry_after = retry_after
+
+
+class QueueFullError(AdmissionError):
+    """All run slots are busy and the wait queue is full."""
+
+
+class QueueTimeoutError(AdmissionError):
+    """Run waited in the queue for longer than the queue timeout."""
+
+
+class AdmissionController:
+    """Bound the number of concurrent runs, with a bounded wait queue.
+
+    Runs beyond max_running wait in a queue of at most max_queued entries
+    for at most queue_timeout seconds. When the queue is full, runs are
+    rejected immediately.
+    """
+
+    def __init__(
+        self,
+        max_running: int,
+        max_queued: int = 0,
+        queue_timeout: float = 30.0,
+        retry_after: int = 5,
+    ):
+        """Initialize
+
+        Args:
+            max_running (int): Max number of runs at the same time.
+            max_queued (int): Max number of runs waiting for a slot.
+            queue_timeout (float): Max seconds a run waits for a slot.
+            retry_after (int): Seconds clients are told to wait before
+                retrying a rejected run.
+        """
+        self.max_running = max_running
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self._cond = Condition()
+        self.running = 0
+        self.queued = 0
+        self.peak_running = 0
+        self.peak_queued = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+
+    def acquire(self):
+        """Wait for a run slot
+
+        Raises:
+            QueueFullError: If no slot is free and the queue is full.
+            QueueTimeoutError: If no slot became free within queue_timeout.
+        """
+        with self._cond:
+            if self.running >= self.max_running:
+                if self.queued >= self.max_queued:
+                    self.rejected += 1
+                    logger.warning(
+                        'Run rejected: %d running, %d queued',
+                        self.running, self.queued)
+                    raise QueueFullError(
+                        QUEUE_FULL_ERR_MSG.format(self.retry_after),
+                        self.retry_after)
+                self.queued += 1
+                self.peak_queued = max(self.peak_queued, self.queued)
+                deadline: float = monotonic() + self.queue_timeout
+                try:
+                    while self.running >= self.max_running:
+                        remaining: float = deadline - monotonic()
+                        if remaining <= 0:
+                            self.timed_out += 1
+                            logger.warning(
+                                'Run timed out after waiting %ss in queue',
+                                self.queue_timeout)
+                            raise QueueTimeoutError(
+                                QUEUE_TIMEOUT_ERR_MSG.format(
+                                    self.retry_after),
+                                self.retry_after)
+                        self._cond.wait(remaining)
+                finally:
+                    self.queued -= 1
+            self.running += 1
+            self.admitted += 1
+            self.peak_running = max(self.peak_running, self.running)
+
+    def release(self):
+        """Free a run slot, waking up the next queued run if any"""
+        with self._cond:
+            self.running -= 1
+            self._cond.notify()
+
+    @contextmanager
+    def slot(self):
+        """Hold a run slot for the duration of the context"""
+        self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self) -> Dict:
+        """Report current load and saturation counters
+
+        Returns:
+            dict: Counters, suitable for serializing as JSON.
+        """
+        with self._cond:
+            return {
+                'max_running': self.max_running,
+                'max_queued': self.max_queued,
+                'running': self.running,
+                'queued': self.queued,
+                'peak_running': self.peak_running,
+                'peak_queued': self.peak_queued,
+                'admitted': self.admitted,
+                'rejected': self.rejected,
+                'timed_out': self.timed_out,
+            }
@@ -1,19 +1,30 @@
 """Generate simple single page form web applications from an argparse CLI."""
 import os
-from argparse import ArgumentParser
-from datetime import datetime
-from typing import List, Dict, Callable
+import socket
+from argparse import ArgumentParser, Action, FileType
+from contextlib import nullcontext
+from threading import Event, Thread
+from time import sleep
+from typing import List, Dict, Callable, Tuple
 
 from flask import Flask, request
 
 # noinspection PyProtectedMember
 from werkzeug.datastructures import FileStorage
 
+from argparse_to_web.admission import AdmissionController
+from argparse_to_web.field_spec import FieldSpec
+from argparse_to_web.job_store import JobStore, SqliteJobStore, \
+    JobFailedError, JobTimeoutError
 from argparse_to_web.routes import routes
 from argparse_to_web.utils import upload_file
+from argparse_to_web.validation import ValidationError, ValidationRule, \
+    html_pattern, compile_rules, validate_submission
 from argparse_to_web.config import TEMP_FILES_ROOT_DIR, NO_TITLE_ERR_MSG, \
     EXCLUDE_ACTIONS, MULTIPLE_INPUT_TYPES, COUNT_TYPE_ERR_MSG, \
-    TYPE_CONVERSIONS, DEL_ATTRS
+    TYPE_CONVERSIONS, DEFAULT_QUEUE_TIMEOUT, DEFAULT_RETRY_AFTER, \
+    DEFAULT_POLL_INTERVAL, DEFAULT_JOB_LEASE, DEFAULT_JOB_TIMEOUT, \
+    JOB_FAILED, MAX_LISTED_CHOICES
 
 
 class ArgparseToWeb:
@@ -39,6 +50,14 @@ class ArgparseToWeb:
         help_overrides: Dict[str, str] = '',
         label_overrides: Dict[str, str] = '',
         send_files_option: str = '',
+        max_concurrent_runs: int = None,
+        max_queued_runs: int = 0,
+        queue_timeout: float = DEFAULT_QUEUE_TIMEOUT,
+        retry_after: int = DEFAULT_RETRY_AFTER,
+        job_store: JobStore = None,
+        run_jobs_locally: bool = True,
+        job_timeout: float = DEFAULT_JOB_TIMEOUT,
+        job_lease: float = DEFAULT_JOB_LEASE,
     ):
         """Initialize
 
@@ -65,6 +84,30 @@ class ArgparseToWeb:
             help_overrides (dict): Map of option names to the a string label
                 to be substituted for what would otherwise be the CLI option
                 name.
+            max_concurrent_runs (int): Max number of submissions passed to
+                the python api at the same time. If not set, there is no
+                limit.
+            max_queued_runs (int): Max number of submissions waiting for one
+                of the max_concurrent_runs to finish. Submissions beyond this
+                are rejected with '429 Too Many Requests'.
+            queue_timeout (float): Max seconds a submission waits in the
+                queue before it is rejected.
+            retry_after (int): Seconds rejected clients are told to wait
+                before retrying, via the 'Retry-After' header.
+            job_store (JobStore): Where jobs and their files are kept. To
+                serve one tool from multiple nodes, pass a store shared
+                between them, e.g. SqliteJobStore on a shared dir. Defaults
+                to a SqliteJobStore in the local temp dir, created when the
+                app is created or work() is called.
+            run_jobs_locally (bool): Whether the node taking a submission
+                also runs it. If False, submissions are left for worker
+                nodes, i.e. ones calling work(), to claim.
+            job_timeout (float): Max seconds to wait for a worker node to
+                finish a submission. If the job has not started by then, it
+                is cancelled. If set to None, there is no limit.
+            job_lease (float): Seconds a worker's claim on a job lasts
+                unless renewed. Workers renew it while running the job, so
+                if a worker dies, another can claim the job once it expires.
         """
         self.app = None
         self.debug = debug
@@ -80,12 +123,26 @@ class ArgparseToWeb:
         self.help_overrides = help_overrides
         self.label_overrides = label_overrides
         self.send_files_option = send_files_option
+        self.admission: AdmissionController = AdmissionController(
+            max_running=max_concurrent_runs,
+            max_queued=max_queued_runs,
+            queue_timeout=queue_timeout,
+            retry_after=retry_after,
+        ) if max_concurrent_runs else None
+        self.job_store: JobStore = job_store
+        self.run_jobs_locally = run_jobs_locally
+        self.job_timeout = job_timeout
+        self.job_lease = job_lease
+        self.worker_name: str = '{}:{}'.format(
+            socket.gethostname(), os.getpid())
 
         self.webform = self.create_webform_spec()
-        self.fields: List[Dict] = \
+        self.fields: List[FieldSpec] = \
             self.webform['fields'] + self.webform['advanced_fields']
         self.checkbox_options = [
-            x['name'] for x in self.fields if x['type'] == 'checkbox']
+            x.name for x in self.fields if x.type == 'checkbox']
+        self.validation_rules: List[ValidationRule] = \
+            compile_rules(self.fields)
         self.print_all_errors: bool = self.debug
         # noinspection PyProtectedMember,PyUnresolvedReferences
         cli_options: List[str] = [
@@ -105,6 +162,67 @@ class ArgparseToWeb:
         self.app = self.create_app()
         self.app.run(debug=self.debug)
 
+    def init_job_store(self) -> JobStore:
+        """Get job store, creating the default one if none was given"""
+        if not self.job_store:
+            self.job_store = SqliteJobStore(TEMP_FILES_ROOT_DIR)
+        return self.job_store
+
+    def work(self, poll_interval: float = DEFAULT_POLL_INTERVAL,
+             once: bool = False):
+        """Run as a worker node, running jobs queued by any node
+
+        Args:
+            poll_interval (float): Seconds to wait when no job is queued.
+            once (bool): Stop when no job is queued, instead of waiting for
+                more.
+        """
+        job_store = self.init_job_store()
+        while True:
+            claimed = job_store.claim(self.worker_name, lease=self.job_lease)
+            if claimed:
+                self.run_job(*claimed)
+            elif once:
+                return
+            else:
+                sleep(poll_interval)
+
+    def run_job(self, job_id: str, kwargs: Dict):
+        """Run claimed job through CLI's python api, and record outcome
+
+        The claim on the job is renewed in the background until it is done.
+
+        Args:
+            job_id (str): Job ID
+            kwargs (dict): Keyword arguments to pass to CLI's python api.
+        """
+        job_store = self.init_job_store()
+        worker: str = self.worker_name
+        done = Event()
+
+        def heartbeat():
+            """Renew claim until job is done or claim is lost"""
+            while not done.wait(self.job_lease / 3):
+                if not job_store.renew(job_id, worker, lease=self.job_lease):
+                    return
+
+        heartbeat_thread = Thread(target=heartbeat, daemon=True)
+        heartbeat_thread.start()
+        try:
+            self.python_api(**kwargs)
+        except Exception as err:
+            job_store.finish(job_id, worker, error=str(err) or repr(err))
+        except BaseException as err:
+            # E.g. SystemExit from parser.error(); record it so the job is
+            # not claimed and run again once its lease expires
+            job_store.finish(job_id, worker, error=repr(err))
+            raise
+        else:
+            job_store.finish(job_id, worker)
+        finally:
+            done.set()
+            heartbeat_thread.join()
+
     def create_webform_spec(self) -> Dict:
         """Convert Argeparse CLI to a web form
 
@@ -114,17 +232,14 @@ class ArgparseToWeb:
         parser = self.parser
         title = self.title
         subtitle = self.subtitle
-        upload_options = self.upload_options
         ignore_options = self.ignore_options
         advanced_options = self.advanced_options
         option_order = self.option_order
         advanced_option_order = self.advanced_option_order
-        help_overrides = self.help_overrides
-        label_overrides = self.label_overrides
 
         spec: Dict = {}
-        spec['fields']: List[Dict] = []
-        spec['advanced_fields']: List[Dict] = []
+        spec['fields']: List[FieldSpec] = []
+        spec['advanced_fields']: List[FieldSpec] = []
         ordered_advanced_options: List[str] = \
             advanced_option_order if advanced_option_order \
             else advanced_options if advanced_options \
@@ -145,130 +260,153 @@ class ArgparseToWeb:
             if hasattr(parser, 'description') and parser.description \
             else ''
 
-        # Generate CLI option dicts
-        for idx, obj in enumerate(cli):
-            option = {}
-            option['cli_type'] = cli[idx].__class__.__name__
-            if option['cli_type'] in EXCLUDE_ACTIONS or \
-                    obj.dest in ignore_options:
-                continue
-            for key in dir(obj):
-                if not key.startswith('_'):
-                    option[key] = getattr(obj, key)
-            spec['fields'].append(option)
+        # Generate CLI option fields, along with the dest of each
+        cli_fields: List[Tuple[str, FieldSpec]] = [
+            (x.dest, self.create_field_spec(x)) for x in cli
+            if x.__class__.__name__ not in EXCLUDE_ACTIONS
+            and x.dest not in ignore_options]
+
+        # Separate advanced and non-advanced options
+        non_advanced_fields: List[Tuple[str, FieldSpec]] = [
+            x for x in cli_fields if x[1].name not in advanced_options]
+        advanced_fields: List[Tuple[str, FieldSpec]] = [
+            x for x in cli_fields if x[1].name in advanced_options]
+
+        # Ordering
+        if option_order:
+            non_advanced_fields = [
+                (dest, fld) for name in option_order
+                for dest, fld in non_advanced_fields if name == dest]
+        spec['fields'] = [fld for _, fld in non_advanced_fields]
+        spec['advanced_fields'] = [
+            fld for name in ordered_advanced_options
+            for dest, fld in advanced_fields if name == dest]
+
+        return spec
+
+    def create_field_spec(self, action: Action) -> FieldSpec:
+        """Convert an Argparse option to a web form field
+
+        Args:
+            action (Action): Argparse option
+
+        Return:
+            FieldSpec: Web form field
+        """
+        upload_options = self.upload_options
+        help_overrides = self.help_overrides
+        label_overrides = self.label_overrides
+        cli_type: str = action.__class__.__name__
 
         # Field name & label
-        for fld in spec['fields']:
-            name: str = fld['metavar'] if fld['metavar'] else fld['dest']
-            name = name.lower()
-            fld['name']: str = name
-            fld['label']: str = name.replace('_', ' ').capitalize()
-            if label_overrides and fld['dest'] in label_overrides.keys():
-                fld['label'] = label_overrides[fld['dest']]
+        name: str = action.metavar if action.metavar else action.dest
+        name = name.lower()
+        label: str = name.replace('_', ' ').capitalize()
+        if label_overrides and action.dest in label_overrides.keys():
+            label = label_overrides[action.dest]
 
         # Multiple inputs
-        for fld in spec['fields']:
-            fld['multiple_input']: bool = True \
-                if fld['cli_type'] in MULTIPLE_INPUT_TYPES or fld['nargs'] \
-                else False
-            fld['multiple_input_has_limit'] = False
-            fld['multiple_input_limit'] = None
-            if fld['nargs'] and isinstance(fld['nargs'], int):
-                fld['multiple_input_limit'] = fld['nargs']
+        multiple_input: bool = True \
+            if cli_type in MULTIPLE_INPUT_TYPES or action.nargs \
+            else False
+        multiple_input_limit: int = action.nargs \
+            if action.nargs and isinstance(action.nargs, int) \
+            else None
 
         # Validation
-        for fld in spec['fields']:
-            fld['validation_type'] = fld['type']
-            if fld['cli_type'] == '_CountAction':
-                if fld['type'] and fld['type'] != int:
-                    msg = COUNT_TYPE_ERR_MSG.format(fld['dest'], fld['type'])
-                    raise TypeError(msg)
-                fld['type']: str = 'int'
-
-        # Convert CLI type to webform type
-        for fld in spec['fields']:
-            if fld['type'] == open or fld['name'] in upload_options:
-                fld['type']: str = 'file'
-            fld['type']: str = fld['type'] if fld['type'] \
-                else TYPE_CONVERSIONS[fld['cli_type']]
+        validation_type = action.type
+        if cli_type == '_CountAction':
+            if action.type and action.type != int:
+                msg = COUNT_TYPE_ERR_MSG.format(action.dest, action.type)
+                raise TypeError(msg)
+            validation_type = int
+
+        # Convert CLI type to webform input type
+        field_type: str = 'file' \
+            if action.type == open or isinstance(action.type, FileType) \
+            or name in upload_options \
+            else TYPE_CONVERSIONS.get(cli_type, 'text')
 
         # Override the originally supplied CLI help text
-        if help_overrides:
-            for fld in spec['fields']:
-                if fld['name'] not in help_overrides.keys():
-                    continue
-                fld['help'] = help_overrides[fld['name']]
+        help_text: str = help_overrides[name] \
+            if help_overrides and name in help_overrides.keys() \
+            else action.help
+
+        fld = FieldSpec(
+            name=name,
+            label=label,
+            type=field_type,
+            help=help_text,
+            default=action.default,
+            choices=action.choices if isinstance(action.choices, range)
+            else tuple(action.choices) if action.choices else None,
+            required=action.required,
+            multiple_input=multiple_input,
+            multiple_input_has_limit=multiple_input_limit is not None,
+            multiple_input_limit=multiple_input_limit,
+            validation_type=validation_type,
+            pattern='',
+        )
+
+        # Constraints which the browser can check before submitting
+        return fld._replace(pattern=html_pattern(fld))
 
-        # Separate advanced and non-advanced options
-        non_advanced_options: List[Dict] = []
-        for idx, fld in enumerate(spec['fields']):
-            if fld['name'] in advanced_options:
-                spec['advanced_fields'].append(spec['fields'][idx])
-            else:
-                non_advanced_options.append(spec['fields'][idx])
-        spec['fields'] = non_advanced_options
+    def handle_submission(self, request_obj: request) -> str:
+        """Pass web form submission to CLI's python api
 
-        # Ordering
-        if option_order:
-            ordered_fields: List[Dict] = []
-            for name in option_order:
-                for fld in spec['fields']:
-                    if name == fld['dest']:
-                        ordered_fields.append(fld)
-            spec['fields'] = ordered_fields
-
-        ordered_advanced_fields: List[Dict] = []
-        for name in ordered_advanced_options:
-            for fld in spec['advanced_fields']:
-                if name == fld['dest']:
-                    ordered_advanced_fields.append(fld)
-        spec['advanced_fields'] = ordered_advanced_fields
-
-        # Delete keys not needed in webform spec
-        for fld in spec['fields']:
-            for key in DEL_ATTRS:
-                del fld[key]
-
-        for fld in spec['advanced_fields']:
-            for key in DEL_ATTRS:
-                del fld[key]
+        Args:
+            request_obj (request): Web request obj
 
-        return spec
+        Returns:
+            str: Job ID if output files were created
 
-    def handle_submission(self, request_obj: request) -> str:
-        """Pass web form submission to CLI's python api
+        Raises:
+            ValidationError: If submission does not satisfy the webform spec.
+                Raised before any uploaded files are saved.
+            AdmissionError: If too many submissions are already running or
+                queued.
+        """
+        # Reject invalid submissions before any work is done
+        errors: List[str] = validate_submission(
+            rules=self.validation_rules,
+            form=request_obj.form,
+            files=request_obj.files)
+        if errors:
+            raise ValidationError(errors)
+
+        with self.admission.slot() if self.admission else nullcontext():
+            return self.run_submission(request_obj)
+
+    def run_submission(self, request_obj: request) -> str:
+        """Save uploads and run CLI's python api on a validated submission
 
         Args:
             request_obj (request): Web request obj
 
         Returns:
-            str: Directory of temp folders if output files were created
+            str: Job ID if output files were created
+
+        Raises:
+            JobFailedError: If CLI's python api raised an error.
+            JobTimeoutError: If job did not finish within job_timeout.
         """
         fields = self.fields
         send_files_param = self.send_files_param
         checkbox_options = self.checkbox_options
-        python_api = self.python_api
-
-        # Create temporary dirs
-        # TODO (low priority): Delete previous request_obj dirs if they've been
-        #  there for more than threshold, 15 min?
-        current_time: datetime = datetime.now()
-        tempdir_name: str = str(current_time)[:19].replace(':', '.')
-        this_requests_temp_dir: str = os.path.join(
-            TEMP_FILES_ROOT_DIR, tempdir_name)
-        this_request_input_dir: str = \
-            os.path.join(this_requests_temp_dir, 'input')
-        this_request_output_dir: str = \
-            os.path.join(this_requests_temp_dir, 'output')
-        os.mkdir(this_requests_temp_dir)
-        os.mkdir(this_request_input_dir)
-        os.mkdir(this_request_output_dir)
+        job_store = self.init_job_store()
+
+        # Create job dirs
+        # TODO (low priority): Delete previous jobs if they've been there for
+        #  more than threshold, 15 min?
+        job_id: str = job_store.create_job()
+        this_request_input_dir: str = job_store.input_dir(job_id)
+        this_request_output_dir: str = job_store.output_dir(job_id)
 
         upload_option_file_paths = {}
         for fld in fields:
-            if fld['type'] != 'file':
+            if fld.type != 'file':
                 continue
-            option: str = fld['name']
+            option: str = fld.name
             upload_option_file_paths[option]: List[str] = []
             files: List[FileStorage] = request_obj.files.getlist(option)
             for file in files:
@@ -307,8 +445,8 @@ class ArgparseToWeb:
         pre_kwargs4 = {}
         for k, v in pre_kwargs3.items():
             for fld in fields:
-                if k == fld['name']:
-                    if fld['multiple_input'] and isinstance(v, str):
+                if k == fld.name:
+                    if fld.multiple_input and isinstance(v, str):
                         new_val: List[str] = v.split(' ')
                         pre_kwargs4[k] = new_val
                     else:
@@ -326,11 +464,22 @@ class ArgparseToWeb:
         #     args.append(kwargs.pop(arg))
         # borrow(*args, **kwargs)
 
-        python_api(**kwargs)
+        job_store.enqueue(job_id, kwargs)
+        if self.run_jobs_locally and job_store.claim(
+                self.worker_name, job_id=job_id, lease=self.job_lease):
+            self.run_job(job_id, kwargs)
+        try:
+            job: Dict = job_store.wait(job_id, timeout=self.job_timeout)
+        except JobTimeoutError:
+            # Nobody will be waiting for it, so no worker should start it
+            job_store.cancel(job_id)
+            raise
+        if job['status'] == JOB_FAILED:
+            raise JobFailedError(job['error'])
 
-        output_files: List[str] = os.listdir(this_request_output_dir)
+        output_files: List[str] = job_store.list_outputs(job_id)
 
-        return this_requests_temp_dir if output_files else None
+        return job_id if output_files else None
 
     def create_app(self) -> Flask:
         """Create a Flask application"""
@@ -340,11 +489,11 @@ class ArgparseToWeb:
         app.webform = self.webform
         app.handle_submission = self.handle_submission
         app.print_all_errors = self.print_all_errors
+        app.admission = self.admission
+        app.job_store = self.init_job_store()
         app.config['WEBFORM'] = self.webform
+        app.jinja_env.globals['max_listed_choices'] = MAX_LISTED_CHOICES
 
         app.register_blueprint(routes)
 
-        if not os.path.exists(TEMP_FILES_ROOT_DIR):
-            os.mkdir(TEMP_FILES_ROOT_DIR)
-
         return app
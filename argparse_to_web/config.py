@@ -5,11 +5,20 @@ PKG_DIR = os.path.abspath(os.path.dirname(__file__))
 PROJECT_ROOT_DIR = os.path.join(PKG_DIR, '..')
 TEMP_FILES_ROOT_DIR: str = os.path.join(PROJECT_ROOT_DIR, 'temp')
 # TODO (low priority): Option strings support as dropdown list input widget.
-DEL_ATTRS: tuple = (
-    'container', 'option_strings', 'const', 'dest', 'metavar', 'cli_type',
-    'nargs')
 EXCLUDE_ACTIONS: tuple = ('_HelpAction', '_VersionAction')
 MULTIPLE_INPUT_TYPES: tuple = ('_AppendAction', '_AppendConstAction')
+# Above this, choices are not listed in pages or error messages
+MAX_LISTED_CHOICES: int = 100
+DEFAULT_QUEUE_TIMEOUT: float = 30.0
+DEFAULT_POLL_INTERVAL: float = 1.0
+DEFAULT_JOB_LEASE: float = 60.0
+DEFAULT_JOB_TIMEOUT: float = 600.0
+DEFAULT_RETRY_AFTER: int = 5
+JOB_QUEUED: str = 'queued'
+JOB_RUNNING: str = 'running'
+JOB_DONE: str = 'done'
+JOB_FAILED: str = 'failed'
+JOB_CANCELLED: str = 'cancelled'
 TYPE_CONVERSIONS = {
     '_AppendAction': 'text',
     '_StoreAction': 'text',
@@ -28,3 +37,15 @@ NO_TITLE_ERR_MSG: str = (
     ' by one of the following means: a. Set the "prog" attribute of the '
     'ArgumentParser object, or b. Provide a title parameter to the argeparse '
     'to webform function.')
+REQUIRED_ERR_MSG: str = '"{}" is required.'
+LIMIT_ERR_MSG: str = '"{}" takes exactly {} value(s), but {} were given.'
+CHOICES_ERR_MSG: str = '"{}" got invalid choice(s): {}.'
+VALID_CHOICES_ERR_MSG: str = ' Valid choices: {}.'
+TYPE_ERR_MSG: str = '"{}" got invalid value: {}.'
+QUEUE_FULL_ERR_MSG: str = (
+    'The server is busy and cannot accept more submissions right now. Please '
+    'try again in {} seconds.')
+QUEUE_TIMEOUT_ERR_MSG: str = (
+    'The server was too busy to start your submission in time. Please try '
+    'again in {} seconds.')
+JOB_TIMEOUT_ERR_MSG: str = 'Timed out waiting for job "{}" to finish.'
@@ -0,0 +1,45 @@
+"""Web form field, as converted from an argparse CLI option."""
+from typing import NamedTuple, Callable, Dict, Any, Tuple, Optional, Union
+
+
+def serializable(value: Any) -> Any:
+    """Convert value to one which can be serialized as JSON
+
+    Callables, e.g. CLI types, become their names, and sequences, e.g.
+    choices, become lists.
+    """
+    if value is None or isinstance(value, (str, bool, int, float)):
+        return value
+    if isinstance(value, (list, tuple, range, set, frozenset)):
+        return [serializable(x) for x in value]
+    if isinstance(value, dict):
+        return {str(k): serializable(v) for k, v in value.items()}
+    if callable(value):
+        return getattr(value, '__name__', repr(value))
+    return str(value)
+
+
+class FieldSpec(NamedTuple):
+    """A single web form field.
+
+    Immutable, and holds only what the templates and submission handler
+    use, rather than a reference to the argparse Action it came from.
+    """
+
+    name: str
+    label: str
+    # HTML input type, e.g. 'text'; the CLI type is in validation_type
+    type: str
+    help: Optional[str]
+    default: Any
+    choices: Optional[Union[Tuple, range]]
+    required: bool
+    multiple_input: bool
+    multiple_input_has_limit: bool
+    multiple_input_limit: Optional[int]
+    validation_type: Optional[Callable]
+    pattern: str
+
+    def to_dict(self) -> Dict:
+        """Convert to dict of JSON serializable values"""
+        return {k: serializable(v) for k, v in zip(self._fields, self)}
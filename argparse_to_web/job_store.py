@@ -0,0 +1,317 @@
+"""Job and artifact stores, so that multiple nodes can serve one tool."""
+import json
+import os
+import sqlite3
+import uuid
+from abc import ABC, abstractmethod
+from contextlib import closing
+from time import time, sleep
+from typing import Dict, Tuple, List, BinaryIO
+
+from argparse_to_web.config import JOB_QUEUED, JOB_RUNNING, JOB_DONE, \
+    JOB_FAILED, JOB_CANCELLED, DEFAULT_POLL_INTERVAL, DEFAULT_JOB_LEASE, \
+    JOB_TIMEOUT_ERR_MSG
+
+
+class JobFailedError(Exception):
+    """CLI's python api raised an error while running a job."""
+
+
+class JobTimeoutError(TimeoutError):
+    """Job did not finish within the time allowed to wait for it."""
+
+
+class JobStore(ABC):
+    """Interface for storing jobs and their files.
+
+    A job is created by whichever node takes a submission, run by whichever
+    node claims it, and its output files can be served by any node. A claim
+    is a lease, which the claiming worker must renew while running the job;
+    if the worker dies, the lease expires and another worker can claim the
+    job.
+    """
+
+    @abstractmethod
+    def create_job(self) -> str:
+        """Create a job, along with its input and output dirs
+
+        Returns:
+            str: Job ID
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def input_dir(self, job_id: str) -> str:
+        """Get path of dir to save job's uploaded files to"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def output_dir(self, job_id: str) -> str:
+        """Get path of dir for CLI's python api to save job's output to
+
+        This must be a local path, as CLI's python api writes to it. Serving
+        the output should go through list_outputs() and open_output()
+        instead, so that backends can keep it elsewhere once job is done.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def list_outputs(self, job_id: str) -> List[str]:
+        """List names of job's output files"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def open_output(self, job_id: str, name: str) -> BinaryIO:
+        """Open one of job's output files for reading
+
+        Args:
+            job_id (str): Job ID
+            name (str): Output file name, as returned by list_outputs()
+
+        Raises:
+            FileNotFoundError: If job has no such output file.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def enqueue(self, job_id: str, kwargs: Dict):
+        """Queue job to be run
+
+        Args:
+            job_id (str): Job ID
+            kwargs (dict): Keyword arguments to pass to CLI's python api.
+                Must be JSON serializable.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def claim(
+        self,
+        worker: str,
+        job_id: str = None,
+        lease: float = DEFAULT_JOB_LEASE
+    ) -> Tuple[str, Dict]:
+        """Claim a job to run; only one worker can hold a claim on each job
+
+        Queued jobs can be claimed, as well as running jobs whose lease has
+        expired, e.g. because their worker died.
+
+        Args:
+            worker (str): Name of claiming worker.
+            job_id (str): Job to claim. If not set, the oldest claimable job.
+            lease (float): Seconds until claim expires, unless renewed.
+
+        Returns:
+            tuple: (job ID, kwargs), or None if there was no job to claim.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def renew(
+        self,
+        job_id: str,
+        worker: str,
+        lease: float = DEFAULT_JOB_LEASE
+    ) -> bool:
+        """Extend worker's claim on a running job
+
+        Returns:
+            bool: False if worker no longer holds the claim.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def finish(self, job_id: str, worker: str, error: str = ''):
+        """Mark claimed job as done, or as failed if there was an error
+
+        Does nothing if worker no longer holds the claim.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def cancel(self, job_id: str) -> bool:
+        """Cancel job, if it is still queued
+
+        Returns:
+            bool: Whether job was cancelled.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def get(self, job_id: str) -> Dict:
+        """Get job
+
+        Returns:
+            dict: {'id': ..., 'status': ..., 'error': ..., ...}, or None if
+            no such job.
+        """
+        raise NotImplementedError
+
+    def wait(
+        self,
+        job_id: str,
+        timeout: float = None,
+        poll_interval: float = DEFAULT_POLL_INTERVAL
+    ) -> Dict:
+        """Wait for job to be done, failed or cancelled
+
+        Args:
+            job_id (str): Job ID
+            timeout (float): Max seconds to wait. If not set, no limit.
+            poll_interval (float): Seconds between checks.
+
+        Returns:
+            dict: Job, as returned by get()
+
+        Raises:
+            JobTimeoutError: If job did not finish within timeout.
+        """
+        deadline: float = time() + timeout if timeout else None
+        while True:
+            job: Dict = self.get(job_id)
+            if job['status'] in (JOB_DONE, JOB_FAILED, JOB_CANCELLED):
+                return job
+            if deadline and time() >= deadline:
+                raise JobTimeoutError(JOB_TIMEOUT_ERR_MSG.format(job_id))
+            sleep(poll_interval)
+
+
+class SqliteJobStore(JobStore):
+    """Jobs in a SQLite db, and their files in a dir, under one root dir.
+
+    For multiple nodes, root dir must be shared between them, e.g. over a
+    network file system that supports file locking, and mounted at the same
+    path on each.
+    """
+
+    def __init__(self, root_dir: str):
+        """Initialize
+
+        Args:
+            root_dir (str): Path of dir to keep db and job files in.
+        """
+        self.root_dir = root_dir
+        self.db_path: str = os.path.join(root_dir, 'jobs.sqlite')
+        os.makedirs(root_dir, exist_ok=True)
+        with closing(self.connect()) as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS jobs ('
+                'id TEXT PRIMARY KEY, status TEXT NOT NULL, kwargs TEXT, '
+                'worker TEXT, error TEXT, created REAL, claimed REAL, '
+                'lease_expires REAL, finished REAL)')
+
+    def connect(self) -> sqlite3.Connection:
+        """Connect to db, in autocommit mode"""
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def create_job(self) -> str:
+        """Create a job, along with its input and output dirs"""
+        job_id: str = uuid.uuid4().hex
+        os.makedirs(self.input_dir(job_id))
+        os.makedirs(self.output_dir(job_id))
+        with closing(self.connect()) as conn:
+            conn.execute(
+                'INSERT INTO jobs (id, status, created) VALUES (?, ?, ?)',
+                (job_id, JOB_QUEUED, time()))
+        return job_id
+
+    def input_dir(self, job_id: str) -> str:
+        """Get path of dir to save job's uploaded files to"""
+        return os.path.join(self.root_dir, job_id, 'input')
+
+    def output_dir(self, job_id: str) -> str:
+        """Get path of dir for CLI's python api to save job's output to"""
+        return os.path.join(self.root_dir, job_id, 'output')
+
+    def list_outputs(self, job_id: str) -> List[str]:
+        """List names of job's output files"""
+        output_dir: str = self.output_dir(job_id)
+        return sorted(
+            x for x in os.listdir(output_dir)
+            if os.path.isfile(os.path.join(output_dir, x)))
+
+    def open_output(self, job_id: str, name: str) -> BinaryIO:
+        """Open one of job's output files for reading"""
+        if name not in self.list_outputs(job_id):
+            raise FileNotFoundError(name)
+        return open(os.path.join(self.output_dir(job_id), name), 'rb')
+
+    def enqueue(self, job_id: str, kwargs: Dict):
+        """Queue job to be run"""
+        with closing(self.connect()) as conn:
+            conn.execute(
+                'UPDATE jobs SET kwargs = ?, status = ? WHERE id = ?',
+                (json.dumps(kwargs), JOB_QUEUED, job_id))
+
+    def claim(
+        self,
+        worker: str,
+        job_id: str = None,
+        lease: float = DEFAULT_JOB_LEASE
+    ) -> Tuple[str, Dict]:
+        """Claim a job to run; only one worker can hold a claim on each job"""
+        with closing(self.connect()) as conn:
+            # Write lock up front, so no other worker can claim in between
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                now: float = time()
+                row = conn.execute(
+                    'SELECT id, kwargs FROM jobs WHERE (status = ? '
+                    'OR (status = ? AND lease_expires < ?)) '
+                    'AND kwargs IS NOT NULL AND (? IS NULL OR id = ?) '
+                    'ORDER BY created LIMIT 1',
+                    (JOB_QUEUED, JOB_RUNNING, now, job_id, job_id)
+                ).fetchone()
+                if row:
+                    conn.execute(
+                        'UPDATE jobs SET status = ?, worker = ?, claimed = ?, '
+                        'lease_expires = ? WHERE id = ?',
+                        (JOB_RUNNING, worker, now, now + lease, row['id']))
+                conn.execute('COMMIT')
+            except sqlite3.Error:
+                conn.execute('ROLLBACK')
+                raise
+        return (row['id'], json.loads(row['kwargs'])) if row else None
+
+    def renew(
+        self,
+        job_id: str,
+        worker: str,
+        lease: float = DEFAULT_JOB_LEASE
+    ) -> bool:
+        """Extend worker's claim on a running job"""
+        with closing(self.connect()) as conn:
+            cursor = conn.execute(
+                'UPDATE jobs SET lease_expires = ? '
+                'WHERE id = ? AND status = ? AND worker = ?',
+                (time() + lease, job_id, JOB_RUNNING, worker))
+        return cursor.rowcount == 1
+
+    def finish(self, job_id: str, worker: str, error: str = ''):
+        """Mark claimed job as done, or as failed if there was an error"""
+        with closing(self.connect()) as conn:
+            conn.execute(
+                'UPDATE jobs SET status = ?, error = ?, finished = ? '
+                'WHERE id = ? AND status = ? AND worker = ?',
+                (JOB_FAILED if error else JOB_DONE, error, time(), job_id,
+                 JOB_RUNNING, worker))
+
+    def cancel(self, job_id: str) -> bool:
+        """Cancel job, if it is still queued"""
+        with closing(self.connect()) as conn:
+            cursor = conn.execute(
+                'UPDATE jobs SET status = ?, finished = ? '
+                'WHERE id = ? AND status = ?',
+                (JOB_CANCELLED, time(), job_id, JOB_QUEUED))
+        return cursor.rowcount == 1
+
+    def get(self, job_id: str) -> Dict:
+        """Get job"""
+        with closing(self.connect()) as conn:
+            row = conn.execute(
+                'SELECT id, status, worker, error, created, claimed, '
+                'lease_expires, finished FROM jobs WHERE id = ?',
+                (job_id,)).fetchone()
+        return dict(row) if row else None
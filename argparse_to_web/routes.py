@@ -1,10 +1,15 @@
 """Generate simple single page form web applications from an argparse CLI."""
-import os
+import shutil
+import tempfile
 from typing import List
 from zipfile import ZipFile
 
 from flask import render_template, request, send_file, current_app, \
-    Blueprint
+    Blueprint, jsonify, abort
+
+from argparse_to_web.admission import AdmissionError, QueueFullError
+from argparse_to_web.job_store import JobTimeoutError
+from argparse_to_web.validation import ValidationError
 
 
 routes = Blueprint('routes', __name__)
@@ -25,7 +30,7 @@ def index():
 
     else:
         try:
-            files_loc = handle_submission(request)
+            job_id = handle_submission(request)
 
             # TODO (low priority): capture output or return
             stderr, stdout = '', ''  # get from handle_submission
@@ -34,9 +39,30 @@ def index():
                 'index.html',
                 stderr=stderr,
                 stdout=stdout,
-                files_loc=files_loc,
+                job_id=job_id,
                 webform=webform,)
 
+        except ValidationError as err:
+            return render_template(
+                'index.html',
+                stderr=str(err),
+                webform=webform,), 400
+
+        except AdmissionError as err:
+            status_code: int = 429 if isinstance(err, QueueFullError) \
+                else 503
+            headers = {'Retry-After': str(err.retry_after)}
+            return render_template(
+                'index.html',
+                stderr=str(err),
+                webform=webform,), status_code, headers
+
+        except JobTimeoutError as err:
+            return render_template(
+                'index.html',
+                stderr=str(err),
+                webform=webform,), 504
+
         except Exception as err:
             msg = 'An unexpected error occurred:\n\n'
             if print_all_errors:
@@ -50,22 +76,32 @@ def index():
 @routes.route('/export', methods=['POST'])
 def export():
     """Export"""
-    files_dir: str = os.path.join(request.form['files_loc'], 'output')
-    file_names: List[str] = os.listdir(files_dir)
+    job_store = current_app.job_store
+    job_id: str = request.form['job_id']
+    if not job_store.get(job_id):
+        abort(404)
+    file_names: List[str] = job_store.list_outputs(job_id)
     if file_names:
         if len(file_names) == 1:
             file_name: str = file_names[0]
-            file_path: str = os.path.join(files_dir, file_name)
+            file_obj = job_store.open_output(job_id, file_name)
         else:
+            # Built per request, as other nodes may export the same job
             file_name: str = 'results.zip'
-            file_path: str = os.path.join(files_dir, file_name)
-            with ZipFile(file_path, 'w') as zipfile:
+            file_obj = tempfile.TemporaryFile()
+            with ZipFile(file_obj, 'w') as zipfile:
                 for file in file_names:
-                    path: str = os.path.join(files_dir, file)
-                    zipfile.write(
-                        filename=path,
-                        arcname=file,)
+                    with job_store.open_output(job_id, file) as src, \
+                            zipfile.open(file, 'w') as dst:
+                        shutil.copyfileobj(src, dst)
+            file_obj.seek(0)
         return send_file(
-            filename_or_fp=file_path,
+            filename_or_fp=file_obj,
             as_attachment=True,
             attachment_filename=file_name,)
+
+@routes.route('/status', methods=['GET'])
+def status():
+    """Report admission control load, for sizing deployments"""
+    admission = current_app.admission
+    return jsonify(admission.stats() if admission else {})
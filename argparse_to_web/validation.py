@@ -0,0 +1,204 @@
+"""Validate web form submissions before any uploads are saved."""
+from argparse import ArgumentTypeError, FileType
+from typing import List, Dict, Callable, Collection, NamedTuple, Optional
+
+from argparse_to_web.config import REQUIRED_ERR_MSG, CHOICES_ERR_MSG, \
+    VALID_CHOICES_ERR_MSG, LIMIT_ERR_MSG, TYPE_ERR_MSG, MAX_LISTED_CHOICES
+from argparse_to_web.field_spec import FieldSpec
+
+# Token patterns for types which can be checked by the browser as well. These
+# are only hints, so they err on the side of what Python's int() and float()
+# accept, including surrounding whitespace.
+TYPE_PATTERNS = {
+    int: r'\s*[\-+]?[0-9_]+\s*',
+    float: r'\s*[\-+]?(([0-9_]+\.?[0-9_]*|\.[0-9_]+)([eE][\-+]?[0-9]+)?'
+           r'|[iI][nN][fF]([iI][nN][iI][tT][yY])?|[nN][aA][nN])\s*',
+}
+ANY_TOKEN_PATTERN: str = r'[^ ]+'
+# Only the characters which JS regex syntax (u/v flags) allows escaping
+JS_SPECIAL_CHARS: str = '^$\\.*+?()[]{}|/'
+
+
+class ValidationRule(NamedTuple):
+    """What to check about submitted values of a single web form field."""
+
+    name: str
+    label: str
+    is_file: bool
+    required: bool
+    choices: Optional[Collection]
+    limit: Optional[int]
+    multiple_input: bool
+    converter: Optional[Callable]
+
+
+class ValidationError(ValueError):
+    """Web form submission did not satisfy the webform spec."""
+
+    def __init__(self, errors: List[str]):
+        """Initialize
+
+        Args:
+            errors (list): Messages, one per invalid option.
+        """
+        super().__init__('\n'.join(errors))
+        self.errors = errors
+
+
+def js_escape(text: str) -> str:
+    """Escape text for use in a regex valid in both Python and JS"""
+    return ''.join('\\' + x if x in JS_SPECIAL_CHARS else x for x in text)
+
+
+def listable(choices: Collection) -> bool:
+    """Whether choices are few enough to list in full, e.g. in a page
+
+    Large choices, e.g. range(1, 200000), are only checked on the server,
+    by membership.
+    """
+    return len(choices) <= MAX_LISTED_CHOICES
+
+
+def html_pattern(fld: FieldSpec) -> str:
+    """Compile an HTML5 'pattern' attribute for a text field
+
+    This is only a hint for the browser; the server checks values by
+    converting them as argparse would.
+
+    Args:
+        fld (FieldSpec): Field from webform spec.
+
+    Returns:
+        str: Regex which entire field value must match, or '' if anything
+        goes.
+    """
+    if fld.type in ('file', 'checkbox'):
+        return ''
+    if fld.choices and fld.validation_type in (None, str) \
+            and listable(fld.choices):
+        token: str = '|'.join(js_escape(str(x)) for x in fld.choices)
+    elif fld.validation_type in TYPE_PATTERNS:
+        token: str = TYPE_PATTERNS[fld.validation_type]
+    elif fld.multiple_input_limit:
+        token: str = ANY_TOKEN_PATTERN
+    else:
+        return ''
+    token = '(' + token + ')'
+    if not fld.multiple_input:
+        return token
+    if fld.multiple_input_limit:
+        if fld.multiple_input_limit == 1:
+            return token
+        return token + '( ' + token + '){' + \
+            str(fld.multiple_input_limit - 1) + '}'
+    return token + '( ' + token + ')*'
+
+
+def type_converter(fld: FieldSpec) -> Callable:
+    """Get the CLI type callable to convert values with, if safe to call
+
+    File types are excluded, as calling them opens files.
+
+    Returns:
+        callable: Converter, or None if values are to be left as strings,
+        as argparse does when an option has no type.
+    """
+    converter = fld.validation_type
+    if not callable(converter) or converter == str:
+        return None
+    return converter
+
+
+def convertible(fld: FieldSpec) -> bool:
+    """Whether submitted values can be converted as argparse would"""
+    return fld.type not in ('file', 'checkbox') \
+        and fld.validation_type != open \
+        and not isinstance(fld.validation_type, FileType)
+
+
+def compile_rules(fields: List[FieldSpec]) -> List[ValidationRule]:
+    """Compile validation rules from webform spec fields
+
+    Args:
+        fields (list): Fields from webform spec.
+
+    Returns:
+        list: One rule per field which has something to check.
+    """
+    rules: List[ValidationRule] = []
+    for fld in fields:
+        is_convertible: bool = convertible(fld)
+        rule = ValidationRule(
+            name=fld.name,
+            label=fld.label,
+            is_file=fld.type == 'file',
+            required=fld.required and fld.type != 'checkbox',
+            choices=fld.choices if is_convertible else None,
+            limit=fld.multiple_input_limit,
+            multiple_input=fld.multiple_input,
+            converter=type_converter(fld) if is_convertible else None,
+        )
+        if rule.required or rule.choices or rule.limit or rule.converter:
+            rules.append(rule)
+    return rules
+
+
+def validate_submission(
+    rules: List[ValidationRule],
+    form: Dict,
+    files: Dict
+) -> List[str]:
+    """Check submitted form fields against validation rules
+
+    Args:
+        rules (list): Rules, as returned by compile_rules().
+        form (MultiDict): Submitted form fields.
+        files (MultiDict): Submitted files; only their names are inspected,
+            nothing is saved.
+
+    Returns:
+        list: Error messages; empty if submission is valid.
+    """
+    errors: List[str] = []
+    for rule in rules:
+        name: str = rule.name
+        label: str = rule.label
+        if rule.is_file:
+            values: List[str] = [
+                x.filename for x in files.getlist(name) if x.filename]
+        else:
+            value: str = form.get(name, '')
+            values: List[str] = [] if not value \
+                else value.split(' ') if rule.multiple_input \
+                else [value]
+
+        if not values:
+            if rule.required:
+                errors.append(REQUIRED_ERR_MSG.format(label))
+            continue
+        if rule.limit and len(values) != rule.limit:
+            errors.append(LIMIT_ERR_MSG.format(
+                label, rule.limit, len(values)))
+            continue
+
+        # Convert and check choices the way argparse does
+        converted: List = []
+        for val in values:
+            try:
+                converted.append(
+                    rule.converter(val) if rule.converter else val)
+            except (TypeError, ValueError, ArgumentTypeError):
+                errors.append(TYPE_ERR_MSG.format(label, val))
+                break
+        else:
+            choices = rule.choices
+            invalid: List[str] = [
+                val for val, conv in zip(values, converted)
+                if choices and conv not in choices]
+            if invalid:
+                msg: str = CHOICES_ERR_MSG.format(label, ', '.join(invalid))
+                if listable(choices):
+                    msg += VALID_CHOICES_ERR_MSG.format(
+                        ', '.join(str(x) for x in choices))
+                errors.append(msg)
+    return errors
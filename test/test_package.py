@@ -1,19 +1,52 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 """Unit tests for  package."""
+import json
 import os
+import re
 import subprocess
+import sys
+import tempfile
 import unittest
+import unittest.mock
+from argparse import ArgumentParser
 from glob import glob
+from io import BytesIO
+from multiprocessing import Pool
+from threading import Thread
+from time import sleep
+from zipfile import ZipFile
 
+from werkzeug.datastructures import MultiDict
 from pmix.borrow import borrow as borrow_api, parser as borrow_parser
 
 from argparse_to_web import ArgparseToWeb
+from argparse_to_web.admission import AdmissionController, QueueFullError, \
+    QueueTimeoutError
+from argparse_to_web.config import JOB_DONE, JOB_FAILED, JOB_RUNNING, \
+    JOB_CANCELLED
+from argparse_to_web.job_store import JobStore, SqliteJobStore
+from argparse_to_web.validation import ValidationError, TYPE_PATTERNS, \
+    validate_submission
 # from argparse_to_web.argparse_to_web import create_app
 from test.config import TEST_STATIC_DIR, TEST_PACKAGES
 from test.utils import get_args, get_test_suite
 
 
+def claim_jobs(root_dir):
+    """Claim queued jobs until there are none left, as a worker process"""
+    job_store = SqliteJobStore(root_dir)
+    worker = str(os.getpid())
+    claimed = []
+    while True:
+        job = job_store.claim(worker)
+        if not job:
+            return claimed
+        job_id, kwargs = job
+        claimed.append(job_id)
+        job_store.finish(job_id, worker, error=kwargs.get('error', ''))
+
+
 class StandardInputOutputTest(unittest.TestCase):
     """Base class for package tests."""
 
@@ -184,6 +217,370 @@ class Borrow(unittest.TestCase):
         self.assertTrue(True)
 
 
+class Validation(unittest.TestCase):
+    """Validation of submissions before python api is called"""
+
+    def setUp(self):
+        """Set up a small CLI whose api must never be reached"""
+        parser = ArgumentParser(prog='Validation')
+        parser.add_argument('--lang', required=True, choices=['en', 'fr'])
+        parser.add_argument('--size', type=int)
+        parser.add_argument('--pair', nargs=2)
+        parser.add_argument('--ratio', type=float, choices=[0.5, 1.0])
+        parser.add_argument('--port', type=int, choices=range(1, 200000))
+        self.parser = parser
+        root_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(root_dir.cleanup)
+        self.app = ArgparseToWeb(
+            parser=parser,
+            python_api=self.fail,
+            job_store=SqliteJobStore(root_dir.name))
+
+    def test_html_constraints(self):
+        """Test that constraints are compiled for the browser"""
+        patterns = {x.name: x.pattern for x in self.app.fields}
+        self.assertEqual(patterns['lang'], '(en|fr)')
+        self.assertEqual(patterns['size'], '(' + TYPE_PATTERNS[int] + ')')
+        self.assertEqual(patterns['pair'], '([^ ]+)( ([^ ]+)){1}')
+        self.assertEqual(patterns['port'], patterns['size'])
+        self.assertTrue(re.fullmatch(patterns['size'], ' +5 '))
+
+    def test_accepts_what_cli_accepts(self):
+        """Test that values argparse accepts pass validation"""
+        form = {'lang': 'en', 'size': ' +5', 'ratio': '1', 'port': '8080'}
+        cli_args = [x for k, v in form.items() for x in ('--' + k, v)]
+        self.parser.parse_args(cli_args)
+        errors = validate_submission(
+            rules=self.app.validation_rules,
+            form=MultiDict(form),
+            files=MultiDict())
+        self.assertEqual(errors, [])
+        errors = validate_submission(
+            rules=self.app.validation_rules,
+            form=MultiDict({'lang': 'en', 'ratio': 'inf', 'port': '0'}),
+            files=MultiDict())
+        self.assertEqual(len(errors), 2)
+
+    def test_rejects_invalid(self):
+        """Test that invalid submissions are rejected before api runs"""
+        request_obj = unittest.mock.Mock(
+            form=MultiDict({'lang': 'de', 'size': 'x', 'pair': 'a b c'}),
+            files=MultiDict())
+        with self.assertRaises(ValidationError) as ctx:
+            self.app.handle_submission(request_obj)
+        self.assertEqual(len(ctx.exception.errors), 3)
+
+
+class FieldSpecs(unittest.TestCase):
+    """Web form fields converted from CLI options"""
+
+    def setUp(self):
+        """Set up a CLI with typed options and options sharing a dest"""
+        parser = ArgumentParser(prog='Fields')
+        parser.add_argument('--size', type=int, choices=range(1, 4))
+        parser.add_argument('--feature', action='store_true')
+        parser.add_argument('--no-feature', dest='feature',
+                            action='store_false')
+        parser.add_argument('--name')
+        parser.add_argument('--ratio', type=float)
+        self.parser = parser
+
+    def test_to_dict_round_trip(self):
+        """Test that fields survive a round trip through JSON"""
+        app = ArgparseToWeb(parser=self.parser, python_api=self.fail)
+        for fld in app.fields:
+            fld_dict = fld.to_dict()
+            self.assertEqual(json.loads(json.dumps(fld_dict)), fld_dict)
+        size = app.fields[0].to_dict()
+        self.assertEqual(size['type'], 'text')
+        self.assertEqual(size['validation_type'], 'int')
+        self.assertEqual(size['choices'], [1, 2, 3])
+
+    def test_immutable(self):
+        """Test that fields cannot be changed"""
+        fld = ArgparseToWeb(parser=self.parser, python_api=self.fail).fields[0]
+        with self.assertRaises(AttributeError):
+            fld.name = 'other'
+        self.assertFalse(hasattr(fld, '__dict__'))
+
+    def test_shared_dest_and_ordering(self):
+        """Test that options sharing a dest are all kept, and ordered"""
+        app = ArgparseToWeb(
+            parser=self.parser,
+            python_api=self.fail,
+            advanced_options=['name', 'ratio'],
+            option_order=['feature', 'size'],
+            advanced_option_order=['ratio', 'name'])
+        fields = app.webform['fields']
+        self.assertEqual(
+            [x.name for x in fields], ['feature', 'feature', 'size'])
+        self.assertEqual([x.default for x in fields[:2]], [False, True])
+        self.assertEqual(
+            [x.name for x in app.webform['advanced_fields']],
+            ['ratio', 'name'])
+
+
+class Admission(unittest.TestCase):
+    """Admission control of concurrent runs"""
+
+    def create_client(self, root_dir, **kwargs):
+        """Create app and test client with admission control"""
+        parser = ArgumentParser(prog='Admission')
+        parser.add_argument('--name')
+        app = ArgparseToWeb(
+            parser=parser,
+            python_api=self.fail,
+            job_store=SqliteJobStore(root_dir),
+            max_concurrent_runs=1,
+            retry_after=7,
+            **kwargs)
+        return app.admission, app.create_app().test_client()
+
+    def test_queue_full(self):
+        """Test that runs beyond running and queued limits are rejected"""
+        admission = AdmissionController(
+            max_running=1, max_queued=1, queue_timeout=5)
+        admission.acquire()
+        waiter = Thread(target=admission.acquire)
+        waiter.start()
+        while not admission.stats()['queued']:
+            sleep(0.01)
+        with self.assertRaises(QueueFullError):
+            admission.acquire()
+        admission.release()
+        waiter.join()
+        stats = admission.stats()
+        self.assertEqual(stats['running'], 1)
+        self.assertEqual(stats['peak_queued'], 1)
+        self.assertEqual(stats['rejected'], 1)
+
+    def test_queue_timeout(self):
+        """Test that queued runs give up after the queue timeout"""
+        admission = AdmissionController(
+            max_running=1, max_queued=1, queue_timeout=0.05)
+        admission.acquire()
+        with self.assertRaises(QueueTimeoutError):
+            admission.acquire()
+        self.assertEqual(admission.stats()['timed_out'], 1)
+        self.assertEqual(admission.stats()['queued'], 0)
+
+    def test_route_queue_full(self):
+        """Test 429 with Retry-After when slot and queue are taken"""
+        with tempfile.TemporaryDirectory() as root_dir:
+            admission, client = self.create_client(
+                root_dir, max_queued_runs=1, queue_timeout=5)
+            admission.acquire()
+            waiter = Thread(target=admission.acquire)
+            waiter.start()
+            while not admission.stats()['queued']:
+                sleep(0.01)
+
+            response = client.post('/', data={'name': 'x'})
+            self.assertEqual(response.status_code, 429)
+            self.assertEqual(response.headers['Retry-After'], '7')
+            stats = client.get('/status').get_json()
+            self.assertEqual(stats['running'], 1)
+            self.assertEqual(stats['queued'], 1)
+            self.assertEqual(stats['rejected'], 1)
+
+            admission.release()
+            waiter.join()
+
+    def test_route_queue_timeout(self):
+        """Test 503 with Retry-After when queued past the queue timeout"""
+        with tempfile.TemporaryDirectory() as root_dir:
+            admission, client = self.create_client(
+                root_dir, max_queued_runs=1, queue_timeout=0.05)
+            admission.acquire()
+
+            response = client.post('/', data={'name': 'x'})
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(response.headers['Retry-After'], '7')
+            stats = client.get('/status').get_json()
+            self.assertEqual(stats['timed_out'], 1)
+            self.assertEqual(stats['queued'], 0)
+
+
+class SharedJobStore(unittest.TestCase):
+    """Jobs shared between multiple processes"""
+
+    def test_claim_once(self):
+        """Test that each job is claimed by exactly one worker process"""
+        with tempfile.TemporaryDirectory() as root_dir:
+            job_store = SqliteJobStore(root_dir)
+            job_ids = []
+            for i in range(40):
+                job_id = job_store.create_job()
+                job_store.enqueue(job_id, {'error': 'x' if i % 2 else ''})
+                job_ids.append(job_id)
+            with Pool(4) as pool:
+                claimed = pool.map(claim_jobs, [root_dir] * 4)
+            claimed_ids = [x for worker in claimed for x in worker]
+            self.assertEqual(sorted(claimed_ids), sorted(job_ids))
+            statuses = [job_store.get(x)['status'] for x in job_ids]
+            self.assertEqual(statuses, [JOB_DONE, JOB_FAILED] * 20)
+
+    def test_incomplete_store(self):
+        """Test that a store missing methods fails when created"""
+        class IncompleteJobStore(JobStore):
+            """Store which cannot claim jobs"""
+            def create_job(self):
+                """Create job"""
+                return 'job'
+
+        with self.assertRaises(TypeError):
+            IncompleteJobStore()
+
+    def test_default_store_is_lazy(self):
+        """Test that no default store is created until it is needed"""
+        app = ArgparseToWeb(
+            parser=ArgumentParser(prog='Jobs'), python_api=self.fail)
+        self.assertIsNone(app.job_store)
+
+    def test_expired_lease(self):
+        """Test that jobs of dead workers can be claimed once lease expires"""
+        with tempfile.TemporaryDirectory() as root_dir:
+            job_store = SqliteJobStore(root_dir)
+            job_id = job_store.create_job()
+            job_store.enqueue(job_id, {})
+            self.assertTrue(job_store.claim('dead', lease=0.05))
+            self.assertIsNone(job_store.claim('alive'))
+            sleep(0.1)
+            self.assertEqual(job_store.claim('alive')[0], job_id)
+            self.assertFalse(job_store.renew(job_id, 'dead'))
+            job_store.finish(job_id, 'dead', error='too late')
+            self.assertEqual(job_store.get(job_id)['status'], JOB_RUNNING)
+            job_store.finish(job_id, 'alive')
+            self.assertEqual(job_store.get(job_id)['status'], JOB_DONE)
+
+    def test_heartbeat(self):
+        """Test that a running job's claim is renewed past its lease"""
+        parser = ArgumentParser(prog='Jobs')
+        with tempfile.TemporaryDirectory() as root_dir:
+            job_store = SqliteJobStore(root_dir)
+            app = ArgparseToWeb(
+                parser=parser,
+                python_api=lambda **_: sleep(0.3),
+                job_store=job_store,
+                job_lease=0.1)
+            job_id = job_store.create_job()
+            job_store.enqueue(job_id, {})
+            job_store.claim(app.worker_name, lease=app.job_lease)
+            runner = Thread(target=app.run_job, args=(job_id, {}))
+            runner.start()
+            sleep(0.2)
+            self.assertIsNone(job_store.claim('other'))
+            runner.join()
+            self.assertEqual(job_store.get(job_id)['status'], JOB_DONE)
+
+    def test_wait_timeout(self):
+        """Test that unclaimed jobs are cancelled, with 504, on timeout"""
+        parser = ArgumentParser(prog='Jobs')
+        parser.add_argument('--name')
+        with tempfile.TemporaryDirectory() as root_dir:
+            job_store = SqliteJobStore(root_dir)
+            app = ArgparseToWeb(
+                parser=parser,
+                python_api=self.fail,
+                job_store=job_store,
+                run_jobs_locally=False,
+                job_timeout=0.05)
+            client = app.create_app().test_client()
+            response = client.post('/', data={'name': 'x'})
+            self.assertEqual(response.status_code, 504)
+            job_ids = os.listdir(root_dir)
+            job_ids.remove('jobs.sqlite')
+            self.assertEqual(
+                job_store.get(job_ids[0])['status'], JOB_CANCELLED)
+            self.assertIsNone(job_store.claim('late'))
+
+    def test_export_from_other_node(self):
+        """Test that a job run by one node can be exported by another"""
+        def python_api(outdir, **_):
+            with open(os.path.join(outdir, 'out.txt'), 'w') as file:
+                file.write('out')
+
+        parser = ArgumentParser(prog='Jobs')
+        parser.add_argument('--outdir')
+        with tempfile.TemporaryDirectory() as root_dir:
+            nodes = [
+                ArgparseToWeb(
+                    parser=parser,
+                    python_api=python_api,
+                    job_store=SqliteJobStore(root_dir),
+                    ignore_options=['outdir'])
+                for _ in range(2)]
+            request_obj = unittest.mock.Mock(
+                form=MultiDict(), files=MultiDict())
+            job_id = nodes[0].handle_submission(request_obj)
+            client = nodes[1].create_app().test_client()
+            response = client.post('/export', data={'job_id': job_id})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.data, b'out')
+
+    def test_export_zip(self):
+        """Test that zips are built per export, outside the job's files"""
+        def python_api(outdir, **_):
+            for name in ('a.txt', 'b.txt'):
+                with open(os.path.join(outdir, name), 'w') as file:
+                    file.write(name)
+
+        parser = ArgumentParser(prog='Jobs')
+        parser.add_argument('--outdir')
+        with tempfile.TemporaryDirectory() as root_dir:
+            app = ArgparseToWeb(
+                parser=parser,
+                python_api=python_api,
+                job_store=SqliteJobStore(root_dir),
+                ignore_options=['outdir'])
+            request_obj = unittest.mock.Mock(
+                form=MultiDict(), files=MultiDict())
+            job_id = app.handle_submission(request_obj)
+            client = app.create_app().test_client()
+            for _ in range(2):
+                response = client.post('/export', data={'job_id': job_id})
+                self.assertEqual(response.status_code, 200)
+                with ZipFile(BytesIO(response.data)) as zipfile:
+                    self.assertEqual(zipfile.namelist(), ['a.txt', 'b.txt'])
+            self.assertEqual(
+                app.job_store.list_outputs(job_id), ['a.txt', 'b.txt'])
+
+    def test_outputs(self):
+        """Test that only a job's own output files can be opened"""
+        with tempfile.TemporaryDirectory() as root_dir:
+            job_store = SqliteJobStore(root_dir)
+            job_id = job_store.create_job()
+            path = os.path.join(job_store.output_dir(job_id), 'out.txt')
+            with open(path, 'w') as file:
+                file.write('out')
+            self.assertEqual(job_store.list_outputs(job_id), ['out.txt'])
+            with job_store.open_output(job_id, 'out.txt') as file:
+                self.assertEqual(file.read(), b'out')
+            with self.assertRaises(FileNotFoundError):
+                job_store.open_output(job_id, '../../jobs.sqlite')
+
+    def test_exit_recorded(self):
+        """Test that a job exiting via SystemExit is failed, not re-run"""
+        def python_api(**_):
+            sys.exit(2)
+
+        with tempfile.TemporaryDirectory() as root_dir:
+            job_store = SqliteJobStore(root_dir)
+            app = ArgparseToWeb(
+                parser=ArgumentParser(prog='Jobs'),
+                python_api=python_api,
+                job_store=job_store,
+                job_lease=0.05)
+            job_id = job_store.create_job()
+            job_store.enqueue(job_id, {})
+            job_store.claim(app.worker_name, lease=app.job_lease)
+            with self.assertRaises(SystemExit):
+                app.run_job(job_id, {})
+            self.assertEqual(job_store.get(job_id)['status'], JOB_FAILED)
+            sleep(0.1)
+            self.assertIsNone(job_store.claim('other'))
+
+
 if __name__ == '__main__':
     PARAMS = get_args()
     TEST_SUITE = get_test_suite(TEST_PACKAGES)